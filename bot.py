@@ -16,34 +16,54 @@ from __future__ import annotations
 
 import asyncio
 import imaplib
+import itertools
+import logging
 import os
+import queue
 import re
 import secrets
+import signal
 import smtplib
 import sqlite3
-from contextlib import closing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, suppress
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from email import message_from_bytes
 from email.message import EmailMessage
 from email.policy import default as email_default_policy
+from functools import lru_cache
 from pathlib import Path
-from typing import Iterable
+from typing import Any, Callable, Coroutine, Iterable, Iterator, TypeVar
 
+from aiohttp import web
 from aiogram import Bot, Dispatcher, F, Router
-from aiogram.enums import ParseMode
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.memory import SimpleEventIsolation
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message, CallbackQuery
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from dotenv import load_dotenv
 
+try:
+    import uvloop
+except ImportError:  # Optional speed-up, not available on Windows.
+    uvloop = None
+
 
 # -------------------------------
 # Configuration and constants
 # -------------------------------
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 BOT_EMAIL = os.getenv("BOT_EMAIL", "")
 BOT_EMAIL_PASSWORD = os.getenv("BOT_EMAIL_PASSWORD", "")
@@ -53,12 +73,63 @@ SMTP_HOST = os.getenv("SMTP_HOST", "")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
 DATABASE_PATH = os.getenv("DATABASE_PATH", "bot.db")
 DEFAULT_CONFIRM_DEADLINE_HOURS = int(os.getenv("DEFAULT_CONFIRM_DEADLINE_HOURS", "24"))
+# Public HTTPS base URL for webhook mode; when empty the bot uses long polling.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+# DEBUG also turns on asyncio debug mode and verbose aiogram/aiohttp logs.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN is required. Fill .env first.")
 
-CODE_REGEX = re.compile(r"CODE-(\d{6})")
-ORDER_REGEX = re.compile(r"ORDER-(\d+)")
+CODE_REGEX = re.compile(r"CODE-(\d{6})", re.ASCII)
+ORDER_REGEX = re.compile(r"ORDER-(\d+)", re.ASCII)
+IMAP_KEEPALIVE_SECONDS = 25 * 60
+# Socket timeout of the shared IMAP connection: a half-open connection must
+# fail (and reconnect) instead of blocking every later inbox check.
+IMAP_TIMEOUT_SECONDS = 20
+# ORDER-/CODE- tokens sit at the top of the confirmation template.
+IMAP_BODY_PREVIEW_BYTES = 4096
+# Capacity of the deferred storage write queue.
+DB_QUEUE_SIZE = 1000
+DB_QUEUE_FLUSH_SECONDS = 5
+# Telegram allows roughly 30 outgoing messages per second per bot.
+TELEGRAM_SEND_RATE = 30
+
+# Connection-scoped SQLite tuning: applied to every connection we open.
+# NORMAL sync is durable enough in WAL mode and avoids an fsync per COMMIT.
+SQLITE_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+)
+# INSERT/UPDATE ... RETURNING needs 3.35; UPDATE ... FROM needs 3.33.
+SQLITE_MIN_VERSION = (3, 35, 0)
+# Read-only connections served alongside the single writer (WAL allows it).
+SQLITE_READERS = 4
+# Orders kept in Storage's in-memory LRU cache.
+ORDER_CACHE_SIZE = 10_000
+# Per-connection prepared statement cache (sqlite3 default is 128).
+SQLITE_CACHED_STATEMENTS = 512
+
+# Hot statements shared by several Storage helpers: one SQL text means one
+# entry in each connection's prepared statement cache.
+SQL_SELECT_USER = "SELECT * FROM users WHERE tg_id = ?"
+# Column order matches the Order fields, so rows unpack straight into it.
+ORDER_COLUMNS = (
+    "id, customer_tg_id, assigned_executor_tg_id, title, description, amount, ad_link, status, "
+    "deadline_at, confirm_code, confirm_deadline_at, created_at, updated_at"
+)
+SQL_SELECT_ORDER = f"SELECT {ORDER_COLUMNS} FROM orders WHERE id = ?"
+SQL_ADJUST_BALANCE = "UPDATE users SET balance = balance + ? WHERE tg_id = ?"
+
+T = TypeVar("T")
 
 
 @dataclass
@@ -70,6 +141,27 @@ class User:
     email: str | None
 
 
+@dataclass(slots=True, frozen=True)
+class Order:
+    id: int
+    customer_tg_id: int
+    assigned_executor_tg_id: int | None
+    title: str
+    description: str
+    amount: float
+    ad_link: str | None
+    status: str
+    deadline_at: str
+    confirm_code: str | None
+    confirm_deadline_at: str | None
+    created_at: str
+    updated_at: str
+
+
+def order_row_factory(cursor: sqlite3.Cursor, row: tuple[Any, ...]) -> Order:
+    return Order(*row)
+
+
 class CreateOrderFSM(StatesGroup):
     title = State()
     description = State()
@@ -86,98 +178,196 @@ class Storage:
 
     We keep SQL as close as possible to business actions so the project
     stays easy to deploy on simple hosting (e.g., Beget shared plans).
+
+    One writer connection (serialized by a lock) handles every mutation,
+    while a small pool of read-only connections serves SELECTs concurrently.
+    ``get_order`` is served from a bounded LRU cache that every order
+    mutation invalidates.
     """
 
     def __init__(self, db_path: str) -> None:
+        if sqlite3.sqlite_version_info < SQLITE_MIN_VERSION:
+            required = ".".join(map(str, SQLITE_MIN_VERSION))
+            raise RuntimeError(f"SQLite {required}+ is required, found {sqlite3.sqlite_version}.")
         self.db_path = Path(db_path)
+        self._writer = self._connect(self.db_path)
+        self._write_lock = threading.Lock()
         self._init_schema()
+        # Read-only connections require the database file to exist already.
+        ro_uri = f"{self.db_path.resolve().as_uri()}?mode=ro"
+        self._readers: queue.Queue[sqlite3.Connection] = queue.Queue()
+        for _ in range(SQLITE_READERS):
+            self._readers.put(self._connect(ro_uri, uri=True))
+        self._order_cache: OrderedDict[int, Order] = OrderedDict()
+        self._order_cache_lock = threading.Lock()
+        # Bumped on every invalidation so a read that raced with a write
+        # does not put the stale row back into the cache.
+        self._order_cache_generation = 0
 
-    def _connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path)
+    @staticmethod
+    def _connect(database: str | Path, uri: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            database, uri=uri, check_same_thread=False, cached_statements=SQLITE_CACHED_STATEMENTS
+        )
         conn.row_factory = sqlite3.Row
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
         return conn
 
+    @contextmanager
+    def _read(self) -> Iterator[sqlite3.Connection]:
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @staticmethod
+    def _select_orders(conn: sqlite3.Connection, sql: str, params: Iterable[Any] = ()) -> sqlite3.Cursor:
+        """Execute an ``ORDER_COLUMNS`` query whose rows come back as Order."""
+        cur = conn.cursor()
+        cur.row_factory = order_row_factory
+        return cur.execute(sql, tuple(params))
+
+    def _invalidate_orders(self, *order_ids: int) -> None:
+        with self._order_cache_lock:
+            self._order_cache_generation += 1
+            for order_id in order_ids:
+                self._order_cache.pop(order_id, None)
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        """Run a transaction on the writer connection (commit or rollback)."""
+        with self._write_lock, self._writer:
+            yield self._writer
+
     def _init_schema(self) -> None:
-        with closing(self._connect()) as conn:
-            conn.executescript(
-                """
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    tg_id INTEGER UNIQUE NOT NULL,
-                    role TEXT,
-                    balance REAL NOT NULL DEFAULT 0,
-                    email TEXT
-                );
-
-                CREATE TABLE IF NOT EXISTS orders (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    customer_tg_id INTEGER NOT NULL,
-                    assigned_executor_tg_id INTEGER,
-                    title TEXT NOT NULL,
-                    description TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    ad_link TEXT,
-                    status TEXT NOT NULL,
-                    deadline_at TEXT NOT NULL,
-                    confirm_code TEXT,
-                    confirm_deadline_at TEXT,
-                    created_at TEXT NOT NULL,
-                    updated_at TEXT NOT NULL
-                );
-
-                CREATE TABLE IF NOT EXISTS order_responses (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    order_id INTEGER NOT NULL,
-                    executor_tg_id INTEGER NOT NULL,
-                    created_at TEXT NOT NULL,
-                    UNIQUE(order_id, executor_tg_id)
-                );
-
-                CREATE TABLE IF NOT EXISTS used_confirmation_codes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    code TEXT UNIQUE NOT NULL,
-                    order_id INTEGER NOT NULL,
-                    used_at TEXT NOT NULL
-                );
-                """
-            )
-            conn.commit()
+        # journal_mode is persistent in the database file, so setting it
+        # once here is enough for every later connection.
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tg_id INTEGER UNIQUE NOT NULL,
+                role TEXT,
+                balance REAL NOT NULL DEFAULT 0,
+                email TEXT
+            );
+
+            CREATE TABLE IF NOT EXISTS orders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_tg_id INTEGER NOT NULL,
+                assigned_executor_tg_id INTEGER,
+                title TEXT NOT NULL,
+                description TEXT NOT NULL,
+                amount REAL NOT NULL,
+                ad_link TEXT,
+                status TEXT NOT NULL,
+                deadline_at TEXT NOT NULL,
+                confirm_code TEXT,
+                confirm_deadline_at TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS order_responses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id INTEGER NOT NULL,
+                executor_tg_id INTEGER NOT NULL,
+                created_at TEXT NOT NULL,
+                UNIQUE(order_id, executor_tg_id)
+            );
+
+            CREATE TABLE IF NOT EXISTS used_confirmation_codes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                code TEXT UNIQUE NOT NULL,
+                order_id INTEGER NOT NULL,
+                used_at TEXT NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS blocked_chats (
+                tg_id INTEGER PRIMARY KEY,
+                blocked_at TEXT NOT NULL
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at DESC);
+            CREATE INDEX IF NOT EXISTS idx_orders_assigned_status ON orders(assigned_executor_tg_id, status);
+            CREATE INDEX IF NOT EXISTS idx_orders_customer_created ON orders(customer_tg_id, created_at DESC);
+            CREATE INDEX IF NOT EXISTS idx_orders_confirm_deadline ON orders(status, confirm_deadline_at)
+                WHERE status = 'waiting_email_confirmation';
+            CREATE INDEX IF NOT EXISTS idx_responses_order ON order_responses(order_id, created_at);
+            """
+        )
+        self._writer.commit()
 
     @staticmethod
     def now_iso() -> str:
         return datetime.now(timezone.utc).isoformat()
 
     def get_or_create_user(self, tg_id: int) -> sqlite3.Row:
-        with closing(self._connect()) as conn:
-            row = conn.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,)).fetchone()
-            if row:
-                return row
-            conn.execute("INSERT INTO users (tg_id, role, balance) VALUES (?, NULL, 0)", (tg_id,))
-            conn.commit()
-            return conn.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,)).fetchone()
+        with self._read() as conn:
+            row = conn.execute(SQL_SELECT_USER, (tg_id,)).fetchone()
+        if row:
+            return row
+        # RETURNING yields nothing if a concurrent call inserted the user first.
+        with self._write() as conn:
+            row = conn.execute(
+                "INSERT INTO users (tg_id, role, balance) VALUES (?, NULL, 0) "
+                "ON CONFLICT(tg_id) DO NOTHING RETURNING *",
+                (tg_id,),
+            ).fetchone()
+            return row or conn.execute(SQL_SELECT_USER, (tg_id,)).fetchone()
 
     def set_user_role(self, tg_id: int, role: str) -> None:
-        with closing(self._connect()) as conn:
+        with self._write() as conn:
             conn.execute("UPDATE users SET role = ? WHERE tg_id = ?", (role, tg_id))
-            conn.commit()
 
     def set_user_email(self, tg_id: int, email: str) -> None:
-        with closing(self._connect()) as conn:
+        with self._write() as conn:
             conn.execute("UPDATE users SET email = ? WHERE tg_id = ?", (email, tg_id))
-            conn.commit()
 
     def adjust_balance(self, tg_id: int, delta: float) -> None:
-        with closing(self._connect()) as conn:
-            conn.execute("UPDATE users SET balance = balance + ? WHERE tg_id = ?", (delta, tg_id))
-            conn.commit()
+        with self._write() as conn:
+            conn.execute(SQL_ADJUST_BALANCE, (delta, tg_id))
 
     def get_user(self, tg_id: int) -> sqlite3.Row | None:
-        with closing(self._connect()) as conn:
-            return conn.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,)).fetchone()
+        with self._read() as conn:
+            return conn.execute(SQL_SELECT_USER, (tg_id,)).fetchone()
 
-    def list_executors(self) -> list[sqlite3.Row]:
-        with closing(self._connect()) as conn:
-            return conn.execute("SELECT * FROM users WHERE role = 'executor'").fetchall()
+    def list_executor_tg_ids(self, exclude_tg_id: int) -> list[int]:
+        with self._read() as conn:
+            cur = conn.execute(
+                """
+                SELECT tg_id FROM users
+                WHERE role = 'executor'
+                  AND tg_id != ?
+                  AND tg_id NOT IN (SELECT tg_id FROM blocked_chats)
+                """,
+                (exclude_tg_id,),
+            )
+            return [row[0] for row in cur]
+
+    def mark_chats_blocked(self, *tg_ids: int) -> None:
+        now = self.now_iso()
+        with self._write() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO blocked_chats (tg_id, blocked_at) VALUES (?, ?)",
+                [(tg_id, now) for tg_id in tg_ids],
+            )
+
+    def unblock_chats(self, *tg_ids: int) -> None:
+        placeholders = ", ".join("?" * len(tg_ids))
+        # Almost every chat is reachable: check on a reader first so the
+        # common case never takes the writer lock.
+        with self._read() as conn:
+            blocked = conn.execute(
+                f"SELECT tg_id FROM blocked_chats WHERE tg_id IN ({placeholders})", tg_ids
+            ).fetchall()
+        if not blocked:
+            return
+        with self._write() as conn:
+            conn.executemany("DELETE FROM blocked_chats WHERE tg_id = ?", blocked)
 
     def create_order(
         self,
@@ -187,27 +377,34 @@ class Storage:
         amount: float,
         deadline_hours: int,
         ad_link: str | None,
-    ) -> int:
+    ) -> Order:
+        """Create an open order, reserving its amount from the customer's balance.
+
+        The debit and the insert share one transaction, so escrow is never
+        taken without an order to hold it.
+        """
         now = self.now_iso()
         deadline = (datetime.now(timezone.utc) + timedelta(hours=deadline_hours)).isoformat()
-        with closing(self._connect()) as conn:
-            cur = conn.execute(
-                """
+        with self._write() as conn:
+            conn.execute(SQL_ADJUST_BALANCE, (-amount, customer_tg_id))
+            return self._select_orders(
+                conn,
+                f"""
                 INSERT INTO orders (
                     customer_tg_id, title, description, amount, ad_link, status,
                     deadline_at, created_at, updated_at
                 ) VALUES (?, ?, ?, ?, ?, 'open', ?, ?, ?)
+                RETURNING {ORDER_COLUMNS}
                 """,
                 (customer_tg_id, title, description, amount, ad_link, deadline, now, now),
-            )
-            conn.commit()
-            return int(cur.lastrowid)
-
-    def list_open_orders_for_executor(self, executor_tg_id: int) -> list[sqlite3.Row]:
-        with closing(self._connect()) as conn:
-            return conn.execute(
-                """
-                SELECT * FROM orders
+            ).fetchone()
+
+    def list_open_orders_for_executor(self, executor_tg_id: int) -> list[Order]:
+        with self._read() as conn:
+            return self._select_orders(
+                conn,
+                f"""
+                SELECT {ORDER_COLUMNS} FROM orders
                 WHERE status = 'open'
                   AND customer_tg_id != ?
                 ORDER BY created_at DESC
@@ -216,46 +413,67 @@ class Storage:
             ).fetchall()
 
     def add_response(self, order_id: int, executor_tg_id: int) -> bool:
-        with closing(self._connect()) as conn:
-            try:
+        try:
+            with self._write() as conn:
                 conn.execute(
                     "INSERT INTO order_responses (order_id, executor_tg_id, created_at) VALUES (?, ?, ?)",
                     (order_id, executor_tg_id, self.now_iso()),
                 )
-                conn.commit()
-                return True
-            except sqlite3.IntegrityError:
-                return False
-
-    def list_order_responses(self, order_id: int) -> list[sqlite3.Row]:
-        with closing(self._connect()) as conn:
-            return conn.execute(
-                "SELECT * FROM order_responses WHERE order_id = ? ORDER BY created_at ASC", (order_id,)
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def responses_by_order_ids(self, order_ids: list[int]) -> dict[int, list[sqlite3.Row]]:
+        """Fetch responses for many orders in one query, grouped by order id."""
+        if not order_ids:
+            return {}
+        placeholders = ", ".join("?" * len(order_ids))
+        with self._read() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM order_responses WHERE order_id IN ({placeholders}) ORDER BY order_id, created_at ASC",
+                order_ids,
             ).fetchall()
+        return {order_id: list(group) for order_id, group in itertools.groupby(rows, key=lambda row: row["order_id"])}
 
     def assign_executor(self, order_id: int, executor_tg_id: int) -> None:
-        with closing(self._connect()) as conn:
+        with self._write() as conn:
             conn.execute(
                 "UPDATE orders SET assigned_executor_tg_id = ?, status = 'in_progress', updated_at = ? WHERE id = ?",
                 (executor_tg_id, self.now_iso(), order_id),
             )
-            conn.commit()
-
-    def get_order(self, order_id: int) -> sqlite3.Row | None:
-        with closing(self._connect()) as conn:
-            return conn.execute("SELECT * FROM orders WHERE id = ?", (order_id,)).fetchone()
-
-    def list_customer_orders(self, customer_tg_id: int) -> list[sqlite3.Row]:
-        with closing(self._connect()) as conn:
-            return conn.execute(
-                "SELECT * FROM orders WHERE customer_tg_id = ? ORDER BY created_at DESC", (customer_tg_id,)
+        self._invalidate_orders(order_id)
+
+    def get_order(self, order_id: int) -> Order | None:
+        with self._order_cache_lock:
+            order = self._order_cache.get(order_id)
+            if order is not None:
+                self._order_cache.move_to_end(order_id)
+                return order
+            generation = self._order_cache_generation
+        with self._read() as conn:
+            order = self._select_orders(conn, SQL_SELECT_ORDER, (order_id,)).fetchone()
+        if order is not None:
+            with self._order_cache_lock:
+                if generation == self._order_cache_generation:
+                    self._order_cache[order_id] = order
+                    if len(self._order_cache) > ORDER_CACHE_SIZE:
+                        self._order_cache.popitem(last=False)
+        return order
+
+    def list_customer_orders(self, customer_tg_id: int) -> list[Order]:
+        with self._read() as conn:
+            return self._select_orders(
+                conn,
+                f"SELECT {ORDER_COLUMNS} FROM orders WHERE customer_tg_id = ? ORDER BY created_at DESC",
+                (customer_tg_id,),
             ).fetchall()
 
-    def list_executor_orders(self, executor_tg_id: int) -> list[sqlite3.Row]:
-        with closing(self._connect()) as conn:
-            return conn.execute(
-                """
-                SELECT * FROM orders
+    def list_executor_orders(self, executor_tg_id: int) -> list[Order]:
+        with self._read() as conn:
+            return self._select_orders(
+                conn,
+                f"""
+                SELECT {ORDER_COLUMNS} FROM orders
                 WHERE assigned_executor_tg_id = ?
                   AND status IN ('in_progress', 'waiting_email_confirmation')
                 ORDER BY created_at DESC
@@ -265,7 +483,7 @@ class Storage:
 
     def mark_waiting_email_confirmation(self, order_id: int, code: str) -> str:
         confirm_deadline = (datetime.now(timezone.utc) + timedelta(hours=DEFAULT_CONFIRM_DEADLINE_HOURS)).isoformat()
-        with closing(self._connect()) as conn:
+        with self._write() as conn:
             conn.execute(
                 """
                 UPDATE orders
@@ -274,46 +492,113 @@ class Storage:
                 """,
                 (code, confirm_deadline, self.now_iso(), order_id),
             )
-            conn.commit()
+        self._invalidate_orders(order_id)
         return confirm_deadline
 
-    def is_code_used(self, code: str) -> bool:
-        with closing(self._connect()) as conn:
-            row = conn.execute("SELECT 1 FROM used_confirmation_codes WHERE code = ?", (code,)).fetchone()
-            return row is not None
+    def find_matching_waiting_order(self, order_id: int, executor_tg_id: int, code: str) -> Order | None:
+        """Return the order only if the code confirms it: assigned, waiting, matching and unused."""
+        with self._read() as conn:
+            return self._select_orders(
+                conn,
+                f"""
+                SELECT {ORDER_COLUMNS} FROM orders
+                WHERE id = ?
+                  AND assigned_executor_tg_id = ?
+                  AND status = 'waiting_email_confirmation'
+                  AND confirm_code = ?
+                  AND NOT EXISTS (SELECT 1 FROM used_confirmation_codes u WHERE u.code = ?)
+                """,
+                (order_id, executor_tg_id, code, code),
+            ).fetchone()
 
-    def complete_order_with_code(self, order_id: int, code: str) -> None:
-        with closing(self._connect()) as conn:
-            conn.execute(
-                "UPDATE orders SET status = 'completed', updated_at = ? WHERE id = ?",
-                (self.now_iso(), order_id),
-            )
-            conn.execute(
-                "INSERT INTO used_confirmation_codes (code, order_id, used_at) VALUES (?, ?, ?)",
-                (code, order_id, self.now_iso()),
-            )
-            conn.commit()
+    def complete_order_with_code(self, order_id: int, executor_tg_id: int, code: str) -> bool:
+        """Complete a waiting order and pay its executor in one transaction.
 
-    def list_expired_confirmation_orders(self) -> list[sqlite3.Row]:
+        Returns False when the order no longer waits for this code (e.g. the
+        refund worker got there first) or the code was already used.
+        """
         now = self.now_iso()
-        with closing(self._connect()) as conn:
-            return conn.execute(
-                """
-                SELECT * FROM orders
+        try:
+            with self._write() as conn:
+                row = conn.execute(
+                    """
+                    UPDATE orders SET status = 'completed', updated_at = ?
+                    WHERE id = ?
+                      AND assigned_executor_tg_id = ?
+                      AND status = 'waiting_email_confirmation'
+                      AND confirm_code = ?
+                    RETURNING amount
+                    """,
+                    (now, order_id, executor_tg_id, code),
+                ).fetchone()
+                if row is None:
+                    return False
+                conn.execute(
+                    "INSERT INTO used_confirmation_codes (code, order_id, used_at) VALUES (?, ?, ?)",
+                    (code, order_id, now),
+                )
+                conn.execute(SQL_ADJUST_BALANCE, (row["amount"], executor_tg_id))
+        except sqlite3.IntegrityError:
+            return False
+        finally:
+            self._invalidate_orders(order_id)
+        return True
+
+    def next_confirmation_deadline(self) -> datetime | None:
+        """Earliest deadline among orders still waiting for e-mail confirmation."""
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT MIN(confirm_deadline_at) FROM orders WHERE status = 'waiting_email_confirmation'"
+            ).fetchone()
+        return datetime.fromisoformat(row[0]) if row[0] else None
+
+    def refund_expired_orders(self) -> list[Order]:
+        """Return escrow of every expired confirmation to its customer.
+
+        Balances and statuses are updated in one transaction with set-based
+        statements; the refunded orders are returned for notifications.
+        """
+        now = self.now_iso()
+        with self._write() as conn:
+            expired = self._select_orders(
+                conn,
+                f"""
+                SELECT {ORDER_COLUMNS} FROM orders
                 WHERE status = 'waiting_email_confirmation'
                   AND confirm_deadline_at IS NOT NULL
                   AND confirm_deadline_at <= ?
                 """,
                 (now,),
             ).fetchall()
-
-    def mark_order_refunded(self, order_id: int) -> None:
-        with closing(self._connect()) as conn:
+            if not expired:
+                return []
+            conn.execute(
+                """
+                UPDATE users
+                SET balance = balance + refund.total
+                FROM (
+                    SELECT customer_tg_id, SUM(amount) AS total FROM orders
+                    WHERE status = 'waiting_email_confirmation'
+                      AND confirm_deadline_at IS NOT NULL
+                      AND confirm_deadline_at <= ?
+                    GROUP BY customer_tg_id
+                ) AS refund
+                WHERE users.tg_id = refund.customer_tg_id
+                """,
+                (now,),
+            )
             conn.execute(
-                "UPDATE orders SET status = 'refunded', updated_at = ? WHERE id = ?",
-                (self.now_iso(), order_id),
+                """
+                UPDATE orders
+                SET status = 'refunded', updated_at = ?
+                WHERE status = 'waiting_email_confirmation'
+                  AND confirm_deadline_at IS NOT NULL
+                  AND confirm_deadline_at <= ?
+                """,
+                (now, now),
             )
-            conn.commit()
+        self._invalidate_orders(*(order.id for order in expired))
+        return expired
 
 
 # -------------------------------
@@ -342,104 +627,301 @@ def send_confirmation_email(to_email: str, order_id: int, code: str) -> None:
         smtp.send_message(msg)
 
 
+class ImapClientPool:
+    """Process-lifetime IMAP client shared by all inbox checks.
+
+    Connect + LOGIN dominates the cost of a single inbox check, so the
+    connection is opened lazily once, kept alive with NOOP and dropped on
+    ``imaplib.IMAP4.abort`` so that the next call reconnects.
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: str) -> None:
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self._imap: imaplib.IMAP4_SSL | None = None
+        self._lock = threading.Lock()
+
+    def _ensure_connected(self) -> imaplib.IMAP4_SSL:
+        if self._imap is None:
+            imap = imaplib.IMAP4_SSL(self.host, self.port, timeout=IMAP_TIMEOUT_SECONDS)
+            imap.login(self.user, self.password)
+            imap.select("INBOX")
+            self._imap = imap
+        return self._imap
+
+    def _drop(self) -> None:
+        if self._imap is None:
+            return
+        try:
+            self._imap.logout()
+        except (imaplib.IMAP4.error, OSError):
+            pass
+        self._imap = None
+
+    def run(self, func: Callable[[imaplib.IMAP4_SSL], T]) -> T:
+        """Call func with the shared connection, reconnecting once if it died."""
+        with self._lock:
+            try:
+                return func(self._ensure_connected())
+            except (imaplib.IMAP4.abort, OSError):
+                self._drop()
+            return func(self._ensure_connected())
+
+    def noop(self) -> None:
+        """Keep an idle connection from being closed by the server."""
+        with self._lock:
+            if self._imap is None:
+                return
+            try:
+                self._imap.noop()
+            except (imaplib.IMAP4.abort, OSError):
+                self._drop()
+
+    def close(self) -> None:
+        with self._lock:
+            self._drop()
+
+
+imap_pool = ImapClientPool(IMAP_HOST, IMAP_PORT, BOT_EMAIL, BOT_EMAIL_PASSWORD)
+# IMAP calls queue for one shared connection. Run them on their own thread so
+# waiting inbox checks never occupy the default executor used by storage.
+imap_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="imap")
+
+
+async def run_imap(func: Callable[..., T], *args: Any) -> T:
+    return await asyncio.get_running_loop().run_in_executor(imap_executor, func, *args)
+
+
+def parse_confirmation(text: str) -> tuple[int, str] | None:
+    """Extract (order_id, code) from an e-mail body, if both tokens are present."""
+    order_match = ORDER_REGEX.search(text)
+    code_match = CODE_REGEX.search(text)
+    if order_match and code_match:
+        return int(order_match.group(1)), code_match.group(1)
+    return None
+
+
 def fetch_confirmation_candidates(for_sender: str | None) -> list[tuple[int, str]]:
     """Read bot inbox and extract (order_id, code) from recent e-mails.
 
-    If for_sender is passed, only e-mails from that sender are considered.
+    If for_sender is passed, only e-mails from that sender are considered
+    (filtered by the IMAP server). Only the first few KB of each body are
+    downloaded; the full message is fetched only when the tokens are not
+    readable there (e.g. a base64-encoded part).
     """
-    results: list[tuple[int, str]] = []
-    with imaplib.IMAP4_SSL(IMAP_HOST, IMAP_PORT) as imap:
-        imap.login(BOT_EMAIL, BOT_EMAIL_PASSWORD)
-        imap.select("INBOX")
-        criteria = '(UNSEEN SUBJECT "ORDER-")'
+    criteria = '(UNSEEN SUBJECT "ORDER-")'
+    if for_sender:
+        sender = for_sender.replace("\\", "\\\\").replace('"', '\\"')
+        criteria = f'(UNSEEN SUBJECT "ORDER-" FROM "{sender}")'
+
+    def search(imap: imaplib.IMAP4_SSL) -> list[tuple[int, str]]:
+        results: list[tuple[int, str]] = []
         status, data = imap.search(None, criteria)
+        if status != "OK" or not data[0]:
+            return results
+
+        message_set = b",".join(data[0].split()).decode()
+        status, msg_data = imap.fetch(message_set, f"(BODY.PEEK[TEXT]<0.{IMAP_BODY_PREVIEW_BYTES}>)")
         if status != "OK":
             return results
 
-        for uid in data[0].split():
-            status, msg_data = imap.fetch(uid, "(RFC822)")
-            if status != "OK" or not msg_data or not msg_data[0]:
+        for item in msg_data:
+            if not isinstance(item, tuple):
                 continue
+            found = parse_confirmation(item[1].decode("utf-8", errors="replace"))
+            if found is None:
+                found = parse_confirmation(fetch_full_text(imap, item[0].split()[0]))
+            if found is not None:
+                results.append(found)
+
+        # PEEK leaves messages unread; mark the whole batch processed at once.
+        imap.store(message_set, "+FLAGS", "\\Seen")
+        return results
+
+    return imap_pool.run(search)
+
+
+def fetch_full_text(imap: imaplib.IMAP4_SSL, message_num: bytes) -> str:
+    """Download one full message and return its decoded text body."""
+    status, msg_data = imap.fetch(message_num.decode(), "(BODY.PEEK[])")
+    if status != "OK" or not msg_data or not isinstance(msg_data[0], tuple):
+        return ""
+    parsed = message_from_bytes(msg_data[0][1], policy=email_default_policy)
+    body = parsed.get_body(preferencelist=("plain", "html"))
+    return body.get_content() if body else str(parsed)
 
-            raw_bytes = msg_data[0][1]
-            parsed = message_from_bytes(raw_bytes, policy=email_default_policy)
-            sender = (parsed.get("From") or "").lower()
-            if for_sender and for_sender.lower() not in sender:
-                continue
 
-            body = parsed.get_body(preferencelist=("plain", "html"))
-            text = body.get_content() if body else str(parsed)
+def generate_confirmation_code() -> str:
+    """Six-digit code from a single 4-byte urandom read (modulo bias < 2**-12)."""
+    return f"{int.from_bytes(secrets.token_bytes(4), 'big') % 900000 + 100000}"
 
-            order_match = ORDER_REGEX.search(text)
-            code_match = CODE_REGEX.search(text)
-            if order_match and code_match:
-                results.append((int(order_match.group(1)), code_match.group(1)))
 
-    return results
+# -------------------------------
+# Outgoing message rate limiting
+# -------------------------------
+class TokenBucket:
+    """Async token bucket: ``rate`` acquisitions per second, bursting to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+send_limiter = TokenBucket(TELEGRAM_SEND_RATE, TELEGRAM_SEND_RATE)
 
 
 # -------------------------------
 # Bot UI helpers
 # -------------------------------
+ROLE_KB = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="Заказчик", callback_data="set_role:customer")],
+        [InlineKeyboardButton(text="Исполнитель", callback_data="set_role:executor")],
+    ]
+)
+
+CUSTOMER_MENU = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="➕ Создать заказ", callback_data="customer:create_order")],
+        [InlineKeyboardButton(text="📦 Мои заказы", callback_data="customer:orders")],
+        [InlineKeyboardButton(text="💳 Пополнить баланс +1000", callback_data="wallet:topup")],
+        [InlineKeyboardButton(text="👛 Баланс", callback_data="wallet:show")],
+    ]
+)
+
+EXECUTOR_MENU = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="🧾 Доступные заказы", callback_data="executor:open_orders")],
+        [InlineKeyboardButton(text="📌 Мои активные заказы", callback_data="executor:my_orders")],
+        [InlineKeyboardButton(text="📬 Проверить email подтверждение", callback_data="executor:check_email")],
+        [InlineKeyboardButton(text="👛 Баланс", callback_data="wallet:show")],
+    ]
+)
+
+CHECK_EMAIL_BUTTON = InlineKeyboardButton(text="Проверить email", callback_data="executor:check_email")
+
+
 def role_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Заказчик", callback_data="set_role:customer")],
-            [InlineKeyboardButton(text="Исполнитель", callback_data="set_role:executor")],
-        ]
-    )
+    return ROLE_KB
 
 
 def customer_menu() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="➕ Создать заказ", callback_data="customer:create_order")],
-            [InlineKeyboardButton(text="📦 Мои заказы", callback_data="customer:orders")],
-            [InlineKeyboardButton(text="💳 Пополнить баланс +1000", callback_data="wallet:topup")],
-            [InlineKeyboardButton(text="👛 Баланс", callback_data="wallet:show")],
-        ]
-    )
+    return CUSTOMER_MENU
 
 
 def executor_menu() -> InlineKeyboardMarkup:
+    return EXECUTOR_MENU
+
+
+@lru_cache(maxsize=1024)
+def deliver_button(order_id: int) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text="Сдать заказ", callback_data=f"executor:deliver:{order_id}")
+
+
+@lru_cache(maxsize=1024)
+def respond_keyboard(order_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="🧾 Доступные заказы", callback_data="executor:open_orders")],
-            [InlineKeyboardButton(text="📌 Мои активные заказы", callback_data="executor:my_orders")],
-            [InlineKeyboardButton(text="📬 Проверить email подтверждение", callback_data="executor:check_email")],
-            [InlineKeyboardButton(text="👛 Баланс", callback_data="wallet:show")],
-        ]
+        inline_keyboard=[[InlineKeyboardButton(text="Откликнуться", callback_data=f"executor:respond:{order_id}")]]
+    )
+
+
+@lru_cache(maxsize=1024)
+def deliver_keyboard(order_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[deliver_button(order_id)]])
+
+
+_STATUS_RU = {
+    "open": "Открыт",
+    "in_progress": "В работе",
+    "waiting_email_confirmation": "Ожидает email-подтверждения",
+    "completed": "Завершён",
+    "refunded": "Возврат заказчику",
+}
+
+ORDER_CARD_TEMPLATE = "\n".join(
+    (
+        "Заказ #{id}",
+        "Название: {title}",
+        "Описание: {description}",
+        "Сумма: {amount:.2f}",
+        "Статус: {status}",
+        "Ссылка: {ad_link}",
     )
+)
+
+
+REFUND_CUSTOMER_TEMPLATE = "Срок подтверждения заказа #{oid} истёк. Деньги {amt:.2f} возвращены на ваш баланс."
+REFUND_EXECUTOR_TEMPLATE = "Срок подтверждения по заказу #{oid} истёк. Выплата отменена."
 
 
 def order_status_ru(status: str) -> str:
-    return {
-        "open": "Открыт",
-        "in_progress": "В работе",
-        "waiting_email_confirmation": "Ожидает email-подтверждения",
-        "completed": "Завершён",
-        "refunded": "Возврат заказчику",
-    }.get(status, status)
+    return _STATUS_RU.get(status, status)
 
 
 storage = Storage(DATABASE_PATH)
 router = Router()
+# Bookkeeping writes nobody has to wait for, e.g. remembering blocked chats.
+# A single worker applies them in order; the bound gives natural backpressure.
+_db_queue: asyncio.Queue[tuple[str, tuple[Any, ...]]] = asyncio.Queue(maxsize=DB_QUEUE_SIZE)
+# Variadic Storage methods whose queued calls may be merged into one.
+COALESCED_WRITES = frozenset({"mark_chats_blocked", "unblock_chats"})
+
+
+def format_order(order: Order) -> str:
+    ad_link = order.ad_link or "не указана"
+    return ORDER_CARD_TEMPLATE.format(
+        id=order.id,
+        title=order.title,
+        description=order.description,
+        amount=order.amount,
+        status=order_status_ru(order.status),
+        ad_link=ad_link,
+    )
 
 
-def format_order(order: sqlite3.Row) -> str:
-    return (
-        f"Заказ #{order['id']}\n"
-        f"Название: {order['title']}\n"
-        f"Описание: {order['description']}\n"
-        f"Сумма: {order['amount']:.2f}\n"
-        f"Статус: {order_status_ru(order['status'])}\n"
-        f"Ссылка: {order['ad_link'] or 'не указана'}"
-    )
+async def notify(bot: Bot, chat_id: int, text: str, **kwargs: Any) -> None:
+    """Send a message to a chat the bot may no longer be able to reach.
+
+    Every attempt first takes a token from the bot-wide ``send_limiter``.
+    A 429 is retried once after the delay Telegram asks for; a chat that
+    blocked the bot is remembered so broadcasts skip it. Other API errors
+    are logged, while cancellation propagates normally.
+    """
+    try:
+        try:
+            await send_limiter.acquire()
+            await bot.send_message(chat_id, text, **kwargs)
+        except TelegramRetryAfter as exc:
+            await asyncio.sleep(exc.retry_after)
+            await send_limiter.acquire()
+            await bot.send_message(chat_id, text, **kwargs)
+    except TelegramForbiddenError:
+        await _db_queue.put(("mark_chats_blocked", (chat_id,)))
+    except TelegramAPIError as exc:
+        logger.warning("Failed to send message to %s: %s", chat_id, exc)
 
 
 @router.message(Command("start"))
 async def cmd_start(message: Message) -> None:
-    user = storage.get_or_create_user(message.from_user.id)
+    user = await asyncio.to_thread(storage.get_or_create_user, message.from_user.id)
+    # The user is talking to the bot again, so their chat is reachable.
+    await _db_queue.put(("unblock_chats", (message.from_user.id,)))
     if user["role"] is None:
         await message.answer("Добро пожаловать! Выберите ваш статус:", reply_markup=role_keyboard())
         return
@@ -461,15 +943,15 @@ async def cmd_set_email(message: Message) -> None:
     if len(parts) != 2 or "@" not in parts[1]:
         await message.answer("Использование: /set_email your@email.com")
         return
-    storage.get_or_create_user(message.from_user.id)
-    storage.set_user_email(message.from_user.id, parts[1].strip())
+    await asyncio.to_thread(storage.get_or_create_user, message.from_user.id)
+    await asyncio.to_thread(storage.set_user_email, message.from_user.id, parts[1].strip())
     await message.answer("Email сохранён. Теперь бот сможет отправлять код подтверждения.")
 
 
 @router.callback_query(F.data.startswith("set_role:"))
 async def cb_set_role(callback: CallbackQuery) -> None:
     role = callback.data.split(":", 1)[1]
-    storage.set_user_role(callback.from_user.id, role)
+    await asyncio.to_thread(storage.set_user_role, callback.from_user.id, role)
     await callback.answer("Роль сохранена")
     await callback.message.answer(f"Вы выбрали: {'Заказчик' if role == 'customer' else 'Исполнитель'}")
     await show_menu(callback.message, role)
@@ -477,15 +959,15 @@ async def cb_set_role(callback: CallbackQuery) -> None:
 
 @router.callback_query(F.data == "wallet:show")
 async def cb_wallet_show(callback: CallbackQuery) -> None:
-    user = storage.get_or_create_user(callback.from_user.id)
+    user = await asyncio.to_thread(storage.get_or_create_user, callback.from_user.id)
     await callback.message.answer(f"Ваш баланс: {user['balance']:.2f}")
     await callback.answer()
 
 
 @router.callback_query(F.data == "wallet:topup")
 async def cb_wallet_topup(callback: CallbackQuery) -> None:
-    storage.adjust_balance(callback.from_user.id, 1000)
-    user = storage.get_user(callback.from_user.id)
+    await asyncio.to_thread(storage.adjust_balance, callback.from_user.id, 1000)
+    user = await asyncio.to_thread(storage.get_user, callback.from_user.id)
     await callback.message.answer(f"Баланс пополнен на 1000. Текущий баланс: {user['balance']:.2f}")
     await callback.answer()
 
@@ -544,16 +1026,16 @@ async def fsm_order_deadline(message: Message, state: FSMContext) -> None:
 async def fsm_order_finish(message: Message, state: FSMContext, bot: Bot) -> None:
     data = await state.get_data()
     ad_link = None if message.text.strip() == "-" else message.text.strip()
-    user = storage.get_user(message.from_user.id)
+    user = await asyncio.to_thread(storage.get_user, message.from_user.id)
 
     if user["balance"] < data["amount"]:
         await message.answer("Недостаточно средств. Пополните баланс и создайте заказ заново.")
         await state.clear()
         return
 
-    # Reserve money on escrow: subtract from customer balance immediately.
-    storage.adjust_balance(message.from_user.id, -data["amount"])
-    order_id = storage.create_order(
+    # create_order also reserves the money on escrow (customer balance).
+    order = await asyncio.to_thread(
+        storage.create_order,
         customer_tg_id=message.from_user.id,
         title=data["title"],
         description=data["description"],
@@ -564,51 +1046,44 @@ async def fsm_order_finish(message: Message, state: FSMContext, bot: Bot) -> Non
     await state.clear()
 
     await message.answer(
-        f"Заказ #{order_id} создан и оплачен. Деньги зарезервированы на депозите.",
+        f"Заказ #{order.id} создан и оплачен. Деньги зарезервированы на депозите.",
         reply_markup=customer_menu(),
     )
 
-    # Broadcast to all executors.
-    for executor in storage.list_executors():
-        if executor["tg_id"] == message.from_user.id:
-            continue
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text="Откликнуться",
-                        callback_data=f"executor:respond:{order_id}",
-                    )
-                ]
-            ]
-        )
-        try:
-            await bot.send_message(executor["tg_id"], f"Новый заказ!\n{format_order(storage.get_order(order_id))}", reply_markup=kb)
-        except Exception:
-            # Ignore dead chats / blocked bot to avoid crashing loop.
-            pass
+    # The paced broadcast can take a while: run it outside this update so the
+    # customer's per-user isolation lock is released right away.
+    start_background_task(broadcast_new_order(bot, order), name=f"broadcast-order-{order.id}")
+
+
+async def broadcast_new_order(bot: Bot, order: Order) -> None:
+    """Offer a new order to all executors concurrently; notify() paces the sends."""
+    text = f"Новый заказ!\n{format_order(order)}"
+    kb = respond_keyboard(order.id)
+    executor_tg_ids = await asyncio.to_thread(storage.list_executor_tg_ids, order.customer_tg_id)
+    await asyncio.gather(*(notify(bot, tg_id, text, reply_markup=kb) for tg_id in executor_tg_ids))
 
 
 @router.callback_query(F.data == "customer:orders")
 async def cb_customer_orders(callback: CallbackQuery) -> None:
-    orders = storage.list_customer_orders(callback.from_user.id)
+    orders = await asyncio.to_thread(storage.list_customer_orders, callback.from_user.id)
     if not orders:
         await callback.message.answer("У вас пока нет заказов.")
         await callback.answer()
         return
 
+    responses_by_order = await asyncio.to_thread(storage.responses_by_order_ids, [order.id for order in orders])
     for order in orders:
-        responses = storage.list_order_responses(order["id"])
+        responses = responses_by_order.get(order.id, [])
         text = format_order(order) + f"\nОткликов: {len(responses)}"
         await callback.message.answer(text)
 
         # For open orders with responses, customer can pick executor.
-        if order["status"] == "open" and responses:
+        if order.status == "open" and responses:
             buttons = [
                 [
                     InlineKeyboardButton(
                         text=f"Утвердить исполнителя {resp['executor_tg_id']}",
-                        callback_data=f"customer:approve:{order['id']}:{resp['executor_tg_id']}",
+                        callback_data=f"customer:approve:{order.id}:{resp['executor_tg_id']}",
                     )
                 ]
                 for resp in responses
@@ -620,12 +1095,12 @@ async def cb_customer_orders(callback: CallbackQuery) -> None:
 @router.callback_query(F.data.startswith("executor:respond:"))
 async def cb_executor_respond(callback: CallbackQuery) -> None:
     order_id = int(callback.data.split(":")[-1])
-    order = storage.get_order(order_id)
-    if not order or order["status"] != "open":
+    order = await asyncio.to_thread(storage.get_order, order_id)
+    if not order or order.status != "open":
         await callback.answer("Заказ уже неактуален", show_alert=True)
         return
 
-    ok = storage.add_response(order_id, callback.from_user.id)
+    ok = await asyncio.to_thread(storage.add_response, order_id, callback.from_user.id)
     if not ok:
         await callback.answer("Вы уже откликались на этот заказ")
         return
@@ -638,49 +1113,40 @@ async def cb_customer_approve(callback: CallbackQuery, bot: Bot) -> None:
     _, _, order_id_str, executor_tg_id_str = callback.data.split(":")
     order_id = int(order_id_str)
     executor_tg_id = int(executor_tg_id_str)
-    order = storage.get_order(order_id)
+    order = await asyncio.to_thread(storage.get_order, order_id)
 
-    if not order or order["customer_tg_id"] != callback.from_user.id:
+    if not order or order.customer_tg_id != callback.from_user.id:
         await callback.answer("Недоступно", show_alert=True)
         return
-    if order["status"] != "open":
+    if order.status != "open":
         await callback.answer("Заказ уже обработан", show_alert=True)
         return
 
-    storage.assign_executor(order_id, executor_tg_id)
+    await asyncio.to_thread(storage.assign_executor, order_id, executor_tg_id)
     await callback.answer("Исполнитель утверждён")
     await callback.message.answer(f"Исполнитель {executor_tg_id} назначен на заказ #{order_id}.")
 
-    deliver_kb = InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text="Сдать заказ", callback_data=f"executor:deliver:{order_id}")]]
+    await notify(
+        bot, executor_tg_id, f"Вы назначены исполнителем на заказ #{order_id}.", reply_markup=deliver_keyboard(order_id)
     )
-    try:
-        await bot.send_message(executor_tg_id, f"Вы назначены исполнителем на заказ #{order_id}.", reply_markup=deliver_kb)
-    except Exception:
-        pass
 
 
 @router.callback_query(F.data == "executor:open_orders")
 async def cb_executor_open_orders(callback: CallbackQuery) -> None:
-    orders = storage.list_open_orders_for_executor(callback.from_user.id)
+    orders = await asyncio.to_thread(storage.list_open_orders_for_executor, callback.from_user.id)
     if not orders:
         await callback.message.answer("Доступных заказов нет.")
         await callback.answer()
         return
 
     for order in orders:
-        kb = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="Откликнуться", callback_data=f"executor:respond:{order['id']}")]
-            ]
-        )
-        await callback.message.answer(format_order(order), reply_markup=kb)
+        await callback.message.answer(format_order(order), reply_markup=respond_keyboard(order.id))
     await callback.answer()
 
 
 @router.callback_query(F.data == "executor:my_orders")
 async def cb_executor_my_orders(callback: CallbackQuery) -> None:
-    orders = storage.list_executor_orders(callback.from_user.id)
+    orders = await asyncio.to_thread(storage.list_executor_orders, callback.from_user.id)
     if not orders:
         await callback.message.answer("У вас нет активных заказов.")
         await callback.answer()
@@ -688,10 +1154,10 @@ async def cb_executor_my_orders(callback: CallbackQuery) -> None:
 
     for order in orders:
         buttons = []
-        if order["status"] == "in_progress":
-            buttons.append([InlineKeyboardButton(text="Сдать заказ", callback_data=f"executor:deliver:{order['id']}")])
-        if order["status"] == "waiting_email_confirmation":
-            buttons.append([InlineKeyboardButton(text="Проверить email", callback_data="executor:check_email")])
+        if order.status == "in_progress":
+            buttons.append([deliver_button(order.id)])
+        if order.status == "waiting_email_confirmation":
+            buttons.append([CHECK_EMAIL_BUTTON])
         kb = InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
         await callback.message.answer(format_order(order), reply_markup=kb)
     await callback.answer()
@@ -700,13 +1166,13 @@ async def cb_executor_my_orders(callback: CallbackQuery) -> None:
 @router.callback_query(F.data.startswith("executor:deliver:"))
 async def cb_executor_deliver(callback: CallbackQuery) -> None:
     order_id = int(callback.data.split(":")[-1])
-    order = storage.get_order(order_id)
-    user = storage.get_user(callback.from_user.id)
+    order = await asyncio.to_thread(storage.get_order, order_id)
+    user = await asyncio.to_thread(storage.get_user, callback.from_user.id)
 
-    if not order or order["assigned_executor_tg_id"] != callback.from_user.id:
+    if not order or order.assigned_executor_tg_id != callback.from_user.id:
         await callback.answer("Это не ваш заказ", show_alert=True)
         return
-    if order["status"] != "in_progress":
+    if order.status != "in_progress":
         await callback.answer("Заказ уже в другом статусе", show_alert=True)
         return
     if not user["email"]:
@@ -714,11 +1180,12 @@ async def cb_executor_deliver(callback: CallbackQuery) -> None:
         await callback.answer()
         return
 
-    code = f"{secrets.randbelow(900000) + 100000}"
-    confirm_deadline = storage.mark_waiting_email_confirmation(order_id, code)
+    code = generate_confirmation_code()
+    confirm_deadline = await asyncio.to_thread(storage.mark_waiting_email_confirmation, order_id, code)
+    refund_scheduler.register(datetime.fromisoformat(confirm_deadline))
 
     try:
-        send_confirmation_email(user["email"], order_id, code)
+        await asyncio.to_thread(send_confirmation_email, user["email"], order_id, code)
         await callback.message.answer(
             "Код подтверждения отправлен на ваш email. "
             f"Перешлите письмо на {BOT_EMAIL}, затем нажмите 'Проверить email подтверждение'. "
@@ -731,13 +1198,13 @@ async def cb_executor_deliver(callback: CallbackQuery) -> None:
 
 @router.callback_query(F.data == "executor:check_email")
 async def cb_executor_check_email(callback: CallbackQuery, bot: Bot) -> None:
-    user = storage.get_user(callback.from_user.id)
+    user = await asyncio.to_thread(storage.get_user, callback.from_user.id)
     if not user or not user["email"]:
         await callback.message.answer("Укажите email через /set_email")
         await callback.answer()
         return
 
-    candidates = fetch_confirmation_candidates(user["email"])
+    candidates = await run_imap(fetch_confirmation_candidates, user["email"])
     if not candidates:
         await callback.message.answer("Подходящих писем с кодом пока не найдено.")
         await callback.answer()
@@ -745,29 +1212,20 @@ async def cb_executor_check_email(callback: CallbackQuery, bot: Bot) -> None:
 
     # Try every candidate until successful order completion.
     for order_id, code in candidates:
-        order = storage.get_order(order_id)
+        order = await asyncio.to_thread(storage.find_matching_waiting_order, order_id, callback.from_user.id, code)
         if not order:
             continue
-        if order["assigned_executor_tg_id"] != callback.from_user.id:
-            continue
-        if order["status"] != "waiting_email_confirmation":
-            continue
-        if storage.is_code_used(code):
-            continue
-        if order["confirm_code"] != code:
-            continue
 
-        storage.complete_order_with_code(order_id, code)
-        storage.adjust_balance(callback.from_user.id, order["amount"])
+        completed = await asyncio.to_thread(storage.complete_order_with_code, order_id, callback.from_user.id, code)
+        if not completed:
+            continue
 
-        await callback.message.answer(f"Проверка успешна! Вам начислено {order['amount']:.2f} за заказ #{order_id}.")
-        try:
-            await bot.send_message(
-                order["customer_tg_id"],
-                f"Заказ #{order_id} завершён. Ссылка на объявление: {order['ad_link'] or 'не указана'}",
-            )
-        except Exception:
-            pass
+        await callback.message.answer(f"Проверка успешна! Вам начислено {order.amount:.2f} за заказ #{order_id}.")
+        await notify(
+            bot,
+            order.customer_tg_id,
+            f"Заказ #{order_id} завершён. Ссылка на объявление: {order.ad_link or 'не указана'}",
+        )
         await callback.answer()
         return
 
@@ -775,40 +1233,198 @@ async def cb_executor_check_email(callback: CallbackQuery, bot: Bot) -> None:
     await callback.answer()
 
 
+# The event loop keeps only weak references to tasks: hold them here so
+# long-running workers are not garbage-collected mid-flight.
+_background_tasks: set[asyncio.Task[None]] = set()
+
+
+def start_background_task(coro: Coroutine[Any, Any, None], name: str) -> asyncio.Task[None]:
+    task = asyncio.create_task(coro, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+class RefundScheduler:
+    """Decides when the refund worker has to wake up.
+
+    The worker sleeps towards a single deadline: the earliest one pending.
+    Handlers report new deadlines through ``register`` and only a deadline
+    earlier than the planned one interrupts the sleep.
+    """
+
+    def __init__(self) -> None:
+        self._wakeup = asyncio.Event()
+        # None while the worker is busy or has nothing pending: any new
+        # deadline must then wake it up.
+        self._planned: datetime | None = None
+
+    def register(self, deadline: datetime) -> None:
+        if self._planned is None or deadline < self._planned:
+            self._wakeup.set()
+
+    def start_tick(self) -> None:
+        self._planned = None
+        self._wakeup.clear()
+
+    async def sleep_until(self, deadline: datetime | None) -> None:
+        """Sleep until deadline (forever if None) or an earlier registration."""
+        self._planned = deadline
+        if deadline is None:
+            await self._wakeup.wait()
+            return
+        # A plain TimerHandle that sets the event: no extra Task per sleep.
+        delay = max(1.0, (deadline - datetime.now(timezone.utc)).total_seconds())
+        timer = asyncio.get_running_loop().call_later(delay, self._wakeup.set)
+        try:
+            await self._wakeup.wait()
+        finally:
+            timer.cancel()
+
+
+refund_scheduler = RefundScheduler()
+
+
 async def refund_expired_orders(bot: Bot) -> None:
-    """Background task: return escrow to customer when confirmation expired."""
+    """Background task: return escrow to customer when confirmation expired.
+
+    Instead of polling on a fixed interval the worker sleeps until the
+    earliest confirmation deadline (or indefinitely if there is none), see
+    ``RefundScheduler``.
+    """
     while True:
-        await asyncio.sleep(60)
-        expired = storage.list_expired_confirmation_orders()
-        for order in expired:
-            storage.adjust_balance(order["customer_tg_id"], order["amount"])
-            storage.mark_order_refunded(order["id"])
-            try:
-                await bot.send_message(
-                    order["customer_tg_id"],
-                    f"Срок подтверждения заказа #{order['id']} истёк. Деньги {order['amount']:.2f} возвращены на ваш баланс.",
-                )
-            except Exception:
-                pass
-            if order["assigned_executor_tg_id"]:
-                try:
-                    await bot.send_message(
-                        order["assigned_executor_tg_id"],
-                        f"Срок подтверждения по заказу #{order['id']} истёк. Выплата отменена.",
-                    )
-                except Exception:
-                    pass
+        refund_scheduler.start_tick()
+        # Notifications for every order refunded in this tick go out concurrently.
+        notifications: list[Coroutine[Any, Any, None]] = []
+        for order in await asyncio.to_thread(storage.refund_expired_orders):
+            order_id = order.id
+            notifications.append(
+                notify(bot, order.customer_tg_id, REFUND_CUSTOMER_TEMPLATE.format(oid=order_id, amt=order.amount))
+            )
+            executor_id = order.assigned_executor_tg_id
+            if executor_id is not None:
+                notifications.append(notify(bot, executor_id, REFUND_EXECUTOR_TEMPLATE.format(oid=order_id)))
+        await asyncio.gather(*notifications)
 
+        deadline = await asyncio.to_thread(storage.next_confirmation_deadline)
+        await refund_scheduler.sleep_until(deadline)
 
-async def main() -> None:
-    bot = Bot(BOT_TOKEN, parse_mode=ParseMode.HTML)
-    dp = Dispatcher()
+
+async def db_writer() -> None:
+    """Background task: apply deferred storage writes in arrival order.
+
+    Everything queued while the previous write ran is taken at once, and
+    consecutive calls of a ``COALESCED_WRITES`` method are merged into a
+    single call (one transaction, one executemany).
+    """
+    while True:
+        batch = [await _db_queue.get()]
+        while not _db_queue.empty():
+            batch.append(_db_queue.get_nowait())
+        try:
+            for op, group in itertools.groupby(batch, key=lambda item: item[0]):
+                calls = [args for _, args in group]
+                if op in COALESCED_WRITES:
+                    calls = [tuple(itertools.chain.from_iterable(calls))]
+                for args in calls:
+                    try:
+                        await asyncio.to_thread(getattr(storage, op), *args)
+                    except sqlite3.Error:
+                        logger.exception("Deferred storage write %s%r failed", op, args)
+        finally:
+            for _ in batch:
+                _db_queue.task_done()
+
+
+async def imap_keepalive() -> None:
+    """Background task: NOOP the shared IMAP connection before servers drop it."""
+    while True:
+        await asyncio.sleep(IMAP_KEEPALIVE_SECONDS)
+        await run_imap(imap_pool.noop)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """Serve updates pushed by Telegram to WEBHOOK_URL until cancelled or SIGTERM."""
+    secret = WEBHOOK_SECRET or None
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    await bot.set_webhook(f"{WEBHOOK_URL}{WEBHOOK_PATH}", secret_token=secret)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    # asyncio.Runner only traps SIGINT (start_polling handles both itself):
+    # stop gracefully on SIGTERM too, e.g. from systemd or docker stop.
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    with suppress(NotImplementedError):
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        with suppress(NotImplementedError):
+            loop.remove_signal_handler(signal.SIGTERM)
+        # Also closes the bot session: SimpleRequestHandler registers that on shutdown.
+        await runner.cleanup()
+
+
+def build_dispatcher() -> Dispatcher:
+    # Updates of one user are handled one at a time: the isolation lock is
+    # taken before the FSM state is loaded, so quick consecutive messages in
+    # the order-creation flow each see the state left by the previous one.
+    dp = Dispatcher(events_isolation=SimpleEventIsolation())
     dp.include_router(router)
+    return dp
+
 
-    # Launch background escrow-refund worker.
-    asyncio.create_task(refund_expired_orders(bot))
-    await dp.start_polling(bot)
+async def main() -> None:
+    # Enough pooled keep-alive connections to api.telegram.org for a full
+    # second of rate-limited sends plus regular handler traffic.
+    session = AiohttpSession(limit=100)
+    session._connector_init.update(limit_per_host=TELEGRAM_SEND_RATE, keepalive_timeout=75)
+    bot = Bot(BOT_TOKEN, session=session)
+    dp = build_dispatcher()
+
+    # Launch background escrow-refund worker, deferred DB writer and IMAP keep-alive.
+    start_background_task(refund_expired_orders(bot), name="refund-worker")
+    start_background_task(db_writer(), name="db-writer")
+    start_background_task(imap_keepalive(), name="imap-keepalive")
+    try:
+        if WEBHOOK_URL:
+            await run_webhook(bot, dp)
+        else:
+            # A webhook left over from webhook mode would make getUpdates fail.
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        # Flush deferred writes before stopping the worker that applies them.
+        try:
+            await asyncio.wait_for(_db_queue.join(), timeout=DB_QUEUE_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d deferred storage writes on shutdown", _db_queue.qsize())
+        tasks = list(_background_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await run_imap(imap_pool.close)
+        imap_executor.shutdown()
+
+
+def configure_logging() -> bool:
+    """Set up logging from LOG_LEVEL; return whether debug mode is on."""
+    debug = LOG_LEVEL == "DEBUG"
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if not debug:
+        # aiogram logs every handled update at INFO; keep production output lean.
+        logging.getLogger("aiogram").setLevel(logging.WARNING)
+        logging.getLogger("aiohttp").setLevel(logging.WARNING)
+    return debug
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    debug = configure_logging()
+    loop_factory = uvloop.new_event_loop if uvloop is not None else None
+    # Explicit debug=False also overrides a stray PYTHONASYNCIODEBUG.
+    with asyncio.Runner(debug=debug, loop_factory=loop_factory) as runner:
+        runner.run(main())
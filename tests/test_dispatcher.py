@@ -0,0 +1,76 @@
+"""Dispatcher-level regression tests: updates are fed straight into aiogram."""
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message, Update, User
+
+_tmp_dir = tempfile.TemporaryDirectory()
+os.environ["BOT_TOKEN"] = "123456:TEST"
+os.environ["DATABASE_PATH"] = os.path.join(_tmp_dir.name, "test.db")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import bot  # noqa: E402
+
+
+class FakeSession(BaseSession):
+    """Answers every API call locally instead of talking to Telegram."""
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            return Message(
+                message_id=1, date=datetime.now(), chat=Chat(id=method.chat_id, type="private"), text=method.text
+            )
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def text_update(update_id: int, user_id: int, text: str) -> Update:
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="Test"),
+            text=text,
+        ),
+    )
+
+
+class DispatcherTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The module-level router can be attached to a single dispatcher only.
+        cls.dp = bot.build_dispatcher()
+
+    async def test_fast_messages_in_order_flow_see_previous_state(self):
+        tg_bot = Bot("123456:TEST", session=FakeSession())
+        user_id = 1001
+        state = self.dp.fsm.get_context(bot=tg_bot, chat_id=user_id, user_id=user_id)
+        await state.set_state(bot.CreateOrderFSM.title)
+
+        await asyncio.gather(
+            self.dp.feed_update(tg_bot, text_update(1, user_id, "MyTitle")),
+            self.dp.feed_update(tg_bot, text_update(2, user_id, "MyDescription")),
+        )
+
+        self.assertEqual(await state.get_state(), bot.CreateOrderFSM.amount.state)
+        self.assertEqual(await state.get_data(), {"title": "MyTitle", "description": "MyDescription"})
+
+
+if __name__ == "__main__":
+    unittest.main()
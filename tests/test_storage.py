@@ -0,0 +1,89 @@
+"""Storage tests for the statements that move money between balances."""
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+_tmp_dir = tempfile.TemporaryDirectory()
+os.environ["BOT_TOKEN"] = "123456:TEST"
+os.environ["DATABASE_PATH"] = os.path.join(_tmp_dir.name, "test.db")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import bot  # noqa: E402
+
+CUSTOMER = 1
+EXECUTOR = 2
+
+
+class EscrowStorageTest(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory(ignore_cleanup_errors=True)
+        self.addCleanup(tmp_dir.cleanup)
+        self.storage = bot.Storage(os.path.join(tmp_dir.name, "escrow.db"))
+        for tg_id in (CUSTOMER, EXECUTOR):
+            self.storage.get_or_create_user(tg_id)
+        self.storage.adjust_balance(CUSTOMER, 100)
+
+    def balance(self, tg_id):
+        return self.storage.get_user(tg_id)["balance"]
+
+    def waiting_order(self, amount, code, expired=False):
+        order = self.storage.create_order(CUSTOMER, "Title", "Description", amount, 24, None)
+        self.storage.assign_executor(order.id, EXECUTOR)
+        hours = -1 if expired else 24
+        with mock.patch.object(bot, "DEFAULT_CONFIRM_DEADLINE_HOURS", hours):
+            self.storage.mark_waiting_email_confirmation(order.id, code)
+        return order.id
+
+    def test_refund_credits_every_expired_order_of_a_customer(self):
+        first = self.waiting_order(30, "111111", expired=True)
+        second = self.waiting_order(20, "222222", expired=True)
+        self.waiting_order(10, "333333")
+        self.assertEqual(self.balance(CUSTOMER), 40)
+
+        refunded = self.storage.refund_expired_orders()
+
+        self.assertEqual(sorted(order.id for order in refunded), [first, second])
+        self.assertEqual(self.balance(CUSTOMER), 90)
+        self.assertEqual(self.storage.get_order(first).status, "refunded")
+        self.assertEqual(self.storage.get_order(second).status, "refunded")
+
+    def test_second_refund_run_is_a_no_op(self):
+        self.waiting_order(30, "111111", expired=True)
+        self.storage.refund_expired_orders()
+
+        self.assertEqual(self.storage.refund_expired_orders(), [])
+        self.assertEqual(self.balance(CUSTOMER), 100)
+
+    def test_complete_after_refund_does_not_pay_executor(self):
+        order_id = self.waiting_order(30, "111111", expired=True)
+        self.storage.refund_expired_orders()
+
+        self.assertFalse(self.storage.complete_order_with_code(order_id, EXECUTOR, "111111"))
+        self.assertEqual(self.balance(EXECUTOR), 0)
+        self.assertEqual(self.balance(CUSTOMER), 100)
+        self.assertEqual(self.storage.get_order(order_id).status, "refunded")
+
+    def test_complete_pays_executor_once(self):
+        order_id = self.waiting_order(30, "111111")
+
+        self.assertTrue(self.storage.complete_order_with_code(order_id, EXECUTOR, "111111"))
+        self.assertFalse(self.storage.complete_order_with_code(order_id, EXECUTOR, "111111"))
+        self.assertEqual(self.balance(EXECUTOR), 30)
+        self.assertEqual(self.storage.get_order(order_id).status, "completed")
+
+    def test_reused_code_is_rejected(self):
+        first = self.waiting_order(30, "111111")
+        second = self.waiting_order(20, "111111")
+        self.storage.complete_order_with_code(first, EXECUTOR, "111111")
+
+        self.assertFalse(self.storage.complete_order_with_code(second, EXECUTOR, "111111"))
+        self.assertEqual(self.balance(EXECUTOR), 30)
+        self.assertEqual(self.storage.get_order(second).status, "waiting_email_confirmation")
+
+
+if __name__ == "__main__":
+    unittest.main()